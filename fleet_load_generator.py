@@ -0,0 +1,458 @@
+'''Load generator for capacity planning the Adafruit IO upload path. Intended to be run from desktop python.
+
+Spins up many virtual stations that behave like code.py: each one picks a training color,
+waits out the same add_delay() pacing, then publishes num_samples datapoints in the
+read_samples() payload format. The stations publish to a local stand-in for the Adafruit IO
+REST data endpoint which enforces a per-account rate limit and answers 429 when throttled,
+like the real service does.
+
+Example: 200 stations sharing 10 accounts for 5 simulated minutes, run 10x faster than real time
+
+    python fleet_load_generator.py --stations 200 --accounts 10 --minutes 5 --speedup 10
+'''
+
+import argparse
+import collections
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+##################
+# Defaults below mirror the editable config values in code.py
+# Feed name for Adafruit IO
+default_topic = "colorsensor-training-data"
+
+# milliseconds to gather color data
+sensor_integration_time = 150
+
+# Collect this many samples each time we prompt the user
+num_samples = 5
+
+# Max data values each station tries to send per minute
+max_send_rate = 30
+
+# Data values per minute the stand-in server accepts for each account. 30/min is the free AdafruitIO limit.
+account_rate_limit = 30
+
+# Colors to train and how often a station picks each one
+default_label_mix = "red=1,purple=1,orange=1,yellow=1,green=1"
+
+# Rough RGB bytes the sensor reports for each color, used to fake sensor readings
+color_rgb = {
+    "red": (50, 12, 3),
+    "purple": (30, 15, 25),
+    "orange": (60, 25, 5),
+    "yellow": (60, 50, 10),
+    "green": (15, 45, 10),
+}
+#
+# End of default config values
+##################
+
+
+class RateLimitedFeedServer(ThreadingHTTPServer):
+    """Local stand-in for the Adafruit IO data endpoint
+
+    Accepts POST /api/v2/{username}/feeds/{feed_key}/data and keeps a sliding one minute
+    window of accepted datapoints per username. Once an account has reached 'rate_limit'
+    datapoints in the window, further datapoints are rejected with 429 until the window slides.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, rate_limit, speedup):
+        super().__init__(address, FeedRequestHandler)
+        self.rate_limit = rate_limit
+        # A simulated minute lasts this many real seconds
+        self.window = 60 / speedup
+        self.lock = threading.Lock()
+        self.accepted_times = collections.defaultdict(collections.deque)
+        self.accepted = collections.Counter()
+        self.throttled = collections.Counter()
+        # Most datapoints accepted for each account within any one window
+        self.peak = collections.Counter()
+
+    def try_accept(self, username):
+        """Returns True if the account still has room in its rate limit window
+
+        >>> server = RateLimitedFeedServer(("127.0.0.1", 0), 2, 1)
+        >>> [server.try_accept("a"), server.try_accept("a"), server.try_accept("a")]
+        [True, True, False]
+        >>> server.try_accept("b")
+        True
+        >>> server.accepted["a"], server.throttled["a"], server.peak["a"]
+        (2, 1, 2)
+        >>> server.server_close()
+        """
+        now = time.monotonic()
+        with self.lock:
+            window = self.accepted_times[username]
+            while window and now - window[0] >= self.window:
+                window.popleft()
+            if len(window) >= self.rate_limit:
+                self.throttled[username] += 1
+                return False
+            window.append(now)
+            self.accepted[username] += 1
+            self.peak[username] = max(self.peak[username], len(window))
+            return True
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        if len(parts) != 6 or parts[:2] != ["api", "v2"] or parts[3] != "feeds" or parts[5] != "data":
+            self.reply(404, {"error": "not found"})
+        elif self.server.try_accept(parts[2]):
+            self.reply(200, {"feed_key": parts[4]})
+        else:
+            self.reply(
+                429,
+                {"error": "request failed - Rate limit exceeded. %d data points per minute"
+                 % self.server.rate_limit},
+            )
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Hundreds of stations make the default per-request logging unreadable
+        pass
+
+
+def parse_label_mix(text):
+    """Turn 'red=3,green=1' into a list of labels and a matching list of weights
+
+    :raises ValueError: if a color is unknown or the weights are not usable
+
+    >>> parse_label_mix("red=3, green")
+    (['red', 'green'], [3.0, 1.0])
+    >>> parse_label_mix("gren=1")
+    Traceback (most recent call last):
+    ValueError: unknown color 'gren', expected one of red, purple, orange, yellow, green
+    >>> parse_label_mix("red=abc")
+    Traceback (most recent call last):
+    ValueError: weight for 'red' is not a number: 'abc'
+    >>> parse_label_mix("red=-1")
+    Traceback (most recent call last):
+    ValueError: weight for 'red' must be a non-negative number
+    >>> parse_label_mix("red=0,green=0")
+    Traceback (most recent call last):
+    ValueError: at least one color needs a weight above 0
+    """
+    labels = []
+    weights = []
+    for item in text.split(","):
+        label, _, weight = item.partition("=")
+        label = label.strip()
+        if label not in color_rgb:
+            raise ValueError("unknown color '%s', expected one of %s" % (label, ", ".join(color_rgb)))
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError("weight for '%s' is not a number: '%s'" % (label, weight))
+        if not weight >= 0 or math.isinf(weight):
+            raise ValueError("weight for '%s' must be a non-negative number" % label)
+        labels.append(label)
+        weights.append(weight)
+    if sum(weights) <= 0:
+        raise ValueError("at least one color needs a weight above 0")
+    return labels, weights
+
+
+def make_payload(train_color, rng):
+    """Build a datapoint in the same format read_samples() in code.py publishes"""
+    base = color_rgb[train_color]
+    r, g, b = (max(0, min(255, int(rng.gauss(c, 3)))) for c in base)
+    return "{'temperature': %d, 'r' : %d, 'g': %d, 'b': %d, 'lux' : %d, 'color': '%s'}" % (
+        rng.randint(2000, 9000),
+        r,
+        g,
+        b,
+        rng.randint(20, 400),
+        train_color,
+    )
+
+
+class Station(threading.Thread):
+    """One virtual color sensor station running the code.py main loop"""
+
+    def __init__(self, station_id, username, args, labels, weights, start_time):
+        super().__init__(daemon=True)
+        self.station_id = station_id
+        self.username = username
+        self.args = args
+        self.labels = labels
+        self.weights = weights
+        self.start_time = start_time
+        self.rng = random.Random(args.seed * 100003 + station_id)
+        self.url = "http://%s:%d/api/v2/%s/feeds/%s/data" % (
+            args.host, args.port, username, default_topic,
+        )
+        # Talk straight to the local stand-in even when http_proxy is set, as on many school networks
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        self.accepted = 0
+        self.throttled = 0
+        self.failed = 0
+        # Datapoints given up on after being throttled or failing on every attempt
+        self.dropped = 0
+        # Simulated seconds from the trainer picking a color until each datapoint is accepted or dropped
+        self.queue_delays = []
+        # The station's own simulated clock, only used to measure queueing delay. Sleeps advance it
+        # by the simulated time asked for and HTTP requests by their real, unscaled duration, so
+        # thread scheduling overhead isn't multiplied by --speedup in the delay numbers.
+        self.clock = 0.0
+
+    def time_left(self):
+        return self.args.minutes * 60 - self.simulated_now()
+
+    def sleep(self, simulated_seconds):
+        """Sleep in simulated seconds, cut short at the end of the run"""
+        simulated_seconds = min(simulated_seconds, self.time_left())
+        if simulated_seconds > 0:
+            self.clock += simulated_seconds
+            time.sleep(simulated_seconds / self.args.speedup)
+
+    def simulated_now(self):
+        return (time.monotonic() - self.start_time) * self.args.speedup
+
+    def add_delay(self, elapsed_time):
+        """Same pacing as add_delay() in code.py"""
+        wait_time = (60 / self.args.max_send_rate) * self.args.num_samples
+        if wait_time > elapsed_time:
+            self.sleep(wait_time - elapsed_time)
+
+    def publish(self, payload):
+        """POST one datapoint. Returns 200 or 429, or None if the request failed"""
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"value": payload}).encode(),
+            headers={"Content-Type": "application/json", "X-AIO-Key": "load-test"},
+            method="POST",
+        )
+        sent_time = time.monotonic()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (OSError, http.client.HTTPException):
+            # An overloaded server can drop or garble the connection, count it as failed
+            return None
+        finally:
+            self.clock += time.monotonic() - sent_time
+
+    def read_samples(self, train_color, requested_time):
+        for i in range(self.args.num_samples):
+            self.sleep(sensor_integration_time / 1000)
+            payload = make_payload(train_color, self.rng)
+            attempt = 0
+            # Nothing is sent once the run is over
+            while self.time_left() > 0:
+                status = self.publish(payload)
+                if status == 200:
+                    self.accepted += 1
+                    self.queue_delays.append(self.clock - requested_time)
+                    break
+                if status == 429:
+                    self.throttled += 1
+                else:
+                    self.failed += 1
+                attempt += 1
+                # code.py drops a datapoint that doesn't go through, optionally retry instead
+                if attempt > self.args.retries or self.time_left() <= 0:
+                    self.dropped += 1
+                    self.queue_delays.append(self.clock - requested_time)
+                    break
+                self.sleep(self.args.retry_backoff * attempt)
+
+    def run(self):
+        # Stagger start up so that the whole class doesn't press enter at the same instant
+        self.sleep(self.rng.uniform(0, self.args.think_time))
+        last_data_send_time = -float("inf")
+        while self.time_left() > 0:
+            train_color = self.rng.choices(self.labels, self.weights)[0]
+            self.sleep(self.rng.uniform(0, self.args.jitter))
+            requested_time = self.clock
+
+            # Pace on the same clock as the server's rate window, like code.py pacing on time.time()
+            self.add_delay(self.simulated_now() - last_data_send_time)
+            if self.time_left() <= 0:
+                break
+            last_data_send_time = self.simulated_now()
+            self.read_samples(train_color, requested_time)
+
+            # Time for the trainer to swap the candy and answer the next color prompt
+            self.sleep(self.args.think_time + self.rng.uniform(0, self.args.jitter))
+
+
+def percentile(sorted_values, pct):
+    """Nearest rank percentile of an already sorted list
+
+    >>> [percentile([1, 2, 3, 4, 5], pct) for pct in (0, 50, 90, 99, 100)]
+    [1, 3, 5, 5, 5]
+    >>> percentile([], 50)
+    0.0
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def report(stations, usernames, server, args, simulated_minutes):
+    accepted = sum(s.accepted for s in stations)
+    throttled = sum(s.throttled for s in stations)
+    failed = sum(s.failed for s in stations)
+    attempted = accepted + throttled + failed
+
+    print()
+    print("Simulated %.1f minutes: %d stations on %d accounts, %d samples per color prompt"
+          % (simulated_minutes, len(stations), args.accounts, args.num_samples))
+    print("  Station max_send_rate %d/min, account rate limit %d/min"
+          % (args.max_send_rate, args.rate_limit))
+    print()
+    print("Messages sent:      %d" % attempted)
+    if attempted:
+        print("  Accepted:         %d (%.1f%%)" % (accepted, 100 * accepted / attempted))
+        print("  Throttled (429):  %d (%.1f%%)" % (throttled, 100 * throttled / attempted))
+        print("  Failed:           %d" % failed)
+
+    # Delays are already in simulated seconds so they line up with the code.py settings.
+    # A dropped sample's delay ends when it is given up on, so look at the dropped fraction too.
+    delays = sorted(d for s in stations for d in s.queue_delays)
+    dropped = sum(s.dropped for s in stations)
+    print()
+    print("Queueing delay from color prompt until each sample is accepted or dropped (simulated seconds):")
+    if delays:
+        print("  Samples dropped:  %d of %d (%.1f%%)" % (dropped, len(delays), 100 * dropped / len(delays)))
+    for pct in (50, 90, 95, 99):
+        print("  p%d: %.1f" % (pct, percentile(delays, pct)))
+    if delays:
+        print("  max: %.1f" % delays[-1])
+
+    rates = sorted(s.accepted / simulated_minutes for s in stations)
+    if rates:
+        print()
+        print("Accepted samples/minute per station:")
+        print("  min %.1f  p50 %.1f  max %.1f  mean %.1f"
+              % (rates[0], percentile(rates, 50), rates[-1], sum(rates) / len(rates)))
+
+    # The limit applies to any sliding one minute window, so an account can average more than
+    # the limit over a run that isn't a whole number of minutes. Compare the peak to the limit.
+    print()
+    print("Per account, peak accepted in any one minute window (limit %d) and averages per minute:"
+          % args.rate_limit)
+    for username in usernames:
+        print("  %s: peak %d, %.1f accepted/min, %.1f throttled/min"
+              % (username,
+                 server.peak[username],
+                 server.accepted[username] / simulated_minutes,
+                 server.throttled[username] / simulated_minutes))
+
+    if args.verbose:
+        print()
+        print("Per station:")
+        for s in stations:
+            print("  station %d (%s): %d accepted, %d throttled, %d failed, %d dropped, %.1f samples/min"
+                  % (s.station_id, s.username, s.accepted, s.throttled, s.failed, s.dropped,
+                     s.accepted / simulated_minutes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=100, help="number of virtual stations")
+    parser.add_argument("--accounts", type=int, default=1,
+                        help="Adafruit IO accounts the stations are spread across")
+    parser.add_argument("--minutes", type=float, default=2, help="simulated minutes to run")
+    parser.add_argument("--speedup", type=float, default=1,
+                        help="run this many times faster than real time. Real HTTP and thread "
+                        "time is multiplied by the speedup, so at high speedups stations send "
+                        "less often than code.py would and throttling is under-reported")
+    parser.add_argument("--num-samples", type=int, default=num_samples,
+                        help="samples per color prompt, as in code.py")
+    parser.add_argument("--max-send-rate", type=float, default=max_send_rate,
+                        help="per station data values per minute, as in code.py")
+    parser.add_argument("--rate-limit", type=int, default=account_rate_limit,
+                        help="data values per minute the server accepts per account")
+    parser.add_argument("--labels", default=default_label_mix,
+                        help="color=weight list of training colors")
+    parser.add_argument("--think-time", type=float, default=5,
+                        help="seconds for the trainer to answer each color prompt")
+    parser.add_argument("--jitter", type=float, default=3,
+                        help="random extra seconds added to each prompt")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="times to resend a throttled sample (code.py never resends)")
+    parser.add_argument("--retry-backoff", type=float, default=2,
+                        help="seconds to wait before each resend, multiplied by the attempt number")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="server port, 0 picks a free one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="print a line for every station")
+    args = parser.parse_args()
+
+    if args.stations < 1:
+        parser.error("--stations must be at least 1")
+    if args.accounts < 1:
+        parser.error("--accounts must be at least 1")
+    if args.num_samples < 1:
+        parser.error("--num-samples must be at least 1")
+    if args.rate_limit < 0:
+        parser.error("--rate-limit must not be negative")
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    for name in ("minutes", "speedup", "max_send_rate"):
+        if not getattr(args, name) > 0:
+            parser.error("--%s must be greater than 0" % name.replace("_", "-"))
+    for name in ("think_time", "jitter", "retry_backoff"):
+        if not getattr(args, name) >= 0:
+            parser.error("--%s must not be negative" % name.replace("_", "-"))
+    try:
+        labels, weights = parse_label_mix(args.labels)
+    except ValueError as e:
+        parser.error("--labels: %s" % e)
+
+    server = RateLimitedFeedServer((args.host, args.port), args.rate_limit, args.speedup)
+    args.port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Stand-in Adafruit IO server listening on http://%s:%d" % (args.host, args.port))
+
+    usernames = ["station-account-%d" % i for i in range(args.accounts)]
+    start_time = time.monotonic()
+    stations = [
+        Station(i, usernames[i % args.accounts], args, labels, weights, start_time)
+        for i in range(args.stations)
+    ]
+    print("Running %d stations for %.1f simulated minutes (%.1f real seconds)..."
+          % (args.stations, args.minutes, args.minutes * 60 / args.speedup))
+    for station in stations:
+        station.start()
+    for station in stations:
+        station.join()
+
+    server.shutdown()
+    server.server_close()
+    # Stations stop at the deadline, so rates are over the configured run length
+    report(stations, usernames, server, args, args.minutes)
+
+
+if __name__ == "__main__":
+    main()